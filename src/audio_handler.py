@@ -2,6 +2,7 @@
 import pyaudio
 import wave
 import os
+import session_trace
 
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
@@ -52,6 +53,7 @@ class AudioHandler:
         if self.is_recording and self.stream:
             data = self.stream.read(CHUNK, exception_on_overflow=False)
             self.frames.append(data)
+            session_trace.pcm(data)
 
     def stop_recording(self):
         if not self.is_recording:
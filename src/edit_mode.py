@@ -0,0 +1,207 @@
+
+from keyboard_mapper import KEY_MAP, SPECIAL_KEYS, key_reports, compile_text, normalize_text, write_reports
+
+# Minimal-keystroke edit mode
+# Remembers the last text typed and, for the next response, emits only the
+# keystrokes needed to turn it into the new text (a Myers diff), assuming
+# the host cursor is still at the end of the previous output.
+#
+# Only arrows, Backspace and Delete are used for navigation. Home/End and
+# Ctrl+arrow move by visual line or by word depending on the editor, so they
+# cannot be relied on to land on a known character.
+
+# Beyond this many inserted + deleted characters the texts are too different
+# for an edit to pay off, and the diff is abandoned to bound time and memory.
+MAX_EDIT_DISTANCE = 500
+
+LEFT = key_reports(0, SPECIAL_KEYS['left'])
+RIGHT = key_reports(0, SPECIAL_KEYS['right'])
+BACKSPACE = key_reports(0, SPECIAL_KEYS['backspace'])
+DELETE = key_reports(0, SPECIAL_KEYS['delete'])
+
+
+def myers_diff(a, b, max_distance=MAX_EDIT_DISTANCE):
+    """
+    Returns the shortest edit script from a to b as a list of (op, text) runs,
+    op being '=', '-' or '+'. Returns None if more than max_distance characters
+    would need to be inserted or deleted.
+    """
+    # Common prefix/suffix are cheap to strip and keep the search small
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    a_mid = a[prefix:len(a) - suffix]
+    b_mid = b[prefix:len(b) - suffix]
+
+    edits = _myers(a_mid, b_mid, max_distance)
+    if edits is None:
+        return None
+
+    edits = [('=', c) for c in a[:prefix]] + edits + [('=', c) for c in a[len(a) - suffix:]]
+
+    # Merge single character edits into runs
+    runs = []
+    for op, char in edits:
+        if runs and runs[-1][0] == op:
+            runs[-1] = (op, runs[-1][1] + char)
+        else:
+            runs.append((op, char))
+    return runs
+
+def _myers(a, b, max_distance):
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_distance) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, a, b)
+    return None
+
+def _backtrack(trace, a, b):
+    x, y = len(a), len(b)
+    edits = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+
+        while x > prev_x and y > prev_y:
+            edits.append(('=', a[x - 1]))
+            x -= 1
+            y -= 1
+        if d > 0:
+            if x == prev_x:
+                edits.append(('+', b[y - 1]))
+            else:
+                edits.append(('-', a[x - 1]))
+        x, y = prev_x, prev_y
+
+    edits.reverse()
+    return edits
+
+
+def _blocks(runs):
+    """
+    Groups runs into (equal, deleted, inserted) blocks: an unchanged run
+    followed by the change after it. Only the first equal run and the last
+    change can be empty.
+    """
+    blocks = []
+    equal, deleted, inserted = "", "", ""
+    for op, text in runs:
+        if op == '=':
+            if deleted or inserted:
+                blocks.append((equal, deleted, inserted))
+                deleted, inserted = "", ""
+                equal = text
+            else:
+                equal += text
+        elif op == '-':
+            deleted += text
+        else:
+            inserted += text
+    blocks.append((equal, deleted, inserted))
+    return blocks
+
+def _forward_plan(old, blocks):
+    """Moves left to the first change, then edits left to right with Delete."""
+    prefix = len(blocks[0][0])
+    plan = LEFT * (len(old) - prefix)
+    for i, (equal, deleted, inserted) in enumerate(blocks):
+        if i > 0:
+            plan += RIGHT * len(equal)
+        plan += DELETE * len(deleted) + compile_text(inserted)
+    return plan
+
+def _backward_plan(new, blocks):
+    """Edits right to left with Backspace, then moves right back to the end."""
+    plan = b""
+    for i in range(len(blocks) - 1, -1, -1):
+        equal, deleted, inserted = blocks[i]
+        plan += BACKSPACE * len(deleted) + compile_text(inserted)
+        if i > 0:
+            plan += LEFT * (len(inserted) + len(equal))
+
+    # The cursor now sits after the first insertion
+    cursor = len(blocks[0][0]) + len(blocks[0][2])
+    return plan + RIGHT * (len(new) - cursor)
+
+def plan_edit(old, new):
+    """
+    Returns the report buffer that turns old into new with the fewest keystrokes,
+    editing either forwards or backwards. Returns None if the texts are too
+    different to diff.
+    """
+    runs = myers_diff(old, new)
+    if runs is None:
+        return None
+    blocks = _blocks(runs)
+    if len(blocks) == 1 and not blocks[0][1] and not blocks[0][2]:
+        return b""
+    return min(_forward_plan(old, blocks), _backward_plan(new, blocks), key=len)
+
+def keystrokes(buffer):
+    """Number of key presses in a report buffer (each press is followed by a release)."""
+    return len(buffer) // 16
+
+
+class EditSession:
+    def __init__(self):
+        self.last_text = None
+
+    def emitted(self, text):
+        """The text as it is actually typed: normalized, unmappable characters dropped."""
+        return "".join(c for c in normalize_text(text) if c in KEY_MAP)
+
+    def remember(self, text):
+        """Records text typed by other means as the current output."""
+        self.last_text = self.emitted(text)
+
+    def reset(self):
+        """Forgets the last output, e.g. after something else was typed at the cursor."""
+        self.last_text = None
+
+    def type(self, text):
+        """
+        Types text as an edit of the previous output. Returns (keystrokes sent,
+        keystrokes typing it in full would have taken), or None if there is nothing
+        to edit or editing would not save keystrokes. In that case nothing is typed,
+        and the caller should type the text normally after the previous output.
+        If the edit is cut short, what is on screen is unknown, so the previous
+        output is forgotten rather than edited again.
+        """
+        if self.last_text is None:
+            return None
+        new = self.emitted(text)
+        buffer = plan_edit(self.last_text, new)
+        full = len(new)
+        if buffer is None or keystrokes(buffer) >= full:
+            print("Edit mode: editing would not save keystrokes. Typing in full.")
+            return None
+        sent = keystrokes(buffer)
+        print(f"Edit mode: {sent} keystrokes instead of {full} ({full - sent} saved).")
+        if write_reports(buffer):
+            self.last_text = new
+        else:
+            print("Edit mode: edit was not fully typed. Forgetting the previous output.")
+            self.reset()
+        return sent, full
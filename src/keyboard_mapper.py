@@ -1,6 +1,7 @@
 
 import time
 import os
+import session_trace
 
 # HID Keyboard Usage Codes
 # https://usb.org/sites/default/files/hut1_2.pdf (Page 53)
@@ -36,61 +37,265 @@ KEY_MAP = {
     '?': (2, 0x38),
 } 
 
+# Named non-character keys, used by macros and chords (e.g. "ctrl+shift+tab")
+# Format: name -> usage_code
+SPECIAL_KEYS = {
+    'enter': 0x28, 'return': 0x28, 'esc': 0x29, 'escape': 0x29,
+    'backspace': 0x2A, 'tab': 0x2B, 'space': 0x2C, 'capslock': 0x39,
+    'f1': 0x3A, 'f2': 0x3B, 'f3': 0x3C, 'f4': 0x3D, 'f5': 0x3E, 'f6': 0x3F,
+    'f7': 0x40, 'f8': 0x41, 'f9': 0x42, 'f10': 0x43, 'f11': 0x44, 'f12': 0x45,
+    'printscreen': 0x46, 'scrolllock': 0x47, 'pause': 0x48,
+    'insert': 0x49, 'home': 0x4A, 'pageup': 0x4B, 'delete': 0x4C,
+    'end': 0x4D, 'pagedown': 0x4E,
+    'right': 0x4F, 'left': 0x50, 'down': 0x51, 'up': 0x52,
+}
+
+# Modifier bits for byte 0 of the report
+MODIFIERS = {
+    'ctrl': 0x01, 'control': 0x01, 'shift': 0x02, 'alt': 0x04,
+    'gui': 0x08, 'super': 0x08, 'win': 0x08, 'meta': 0x08, 'cmd': 0x08,
+    'rctrl': 0x10, 'rshift': 0x20, 'ralt': 0x40, 'altgr': 0x40, 'rgui': 0x80,
+}
+
+RELEASE_REPORT = bytes(8)
+
+# Typing pacing (seconds)
+# Hold key for a bit so host sees it
+KEY_HOLD = 0.02
+# Delay between keystrokes to prevent buffer overruns on host
+KEY_GAP = 0.02
+# Extra delay after sentence-ending punctuation to allow host processing (e.g. auto-capitalization)
+SENTENCE_PAUSE = 0.1
+SENTENCE_END = ['.', '!', '?', '\n']
+
+# Gap between reports when playing back a precompiled buffer (macros, edits)
+REPORT_INTERVAL = 0.01
+
 HID_DEV = "/dev/hidg0"
 
-def write_report(report):
-    try:
-        if not os.path.exists(HID_DEV):
-             # For testing/development on non-gadget devices, we just print
-             print(f"DEBUG: HID device {HID_DEV} not found! Skipping write.")
-             print("TIP: Run 'sudo ./scripts/usb_gadget.sh' to configure the device.")
-             return
-
-        # Open in read-write, non-blocking mode to prevent hanging if host is disconnected
-        # and to allow draining the OUT buffer
-        flags = os.O_RDWR
-        if hasattr(os, 'O_NONBLOCK'):
-            flags |= os.O_NONBLOCK
-
-        fd = os.open(HID_DEV, flags)
+# How long the host may leave a report unread before typing is abandoned
+WRITE_TIMEOUT = 0.5
+
+# Set to a typing_process.TypingProcess to write reports from a dedicated process
+typist = None
+
+class HidWriter:
+    """Keeps the HID device open for a whole buffer of reports."""
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def open(self):
+        if not os.path.exists(self.path):
+            # For testing/development on non-gadget devices, we just print
+            print(f"DEBUG: HID device {self.path} not found! Skipping write.")
+            print("TIP: Run 'sudo ./scripts/usb_gadget.sh' to configure the device.")
+            return False
         try:
-            # Drain any pending OUT reports (e.g. LED statuses) to prevent gadget freeze
-            try:
-                while True:
-                    os.read(fd, 8)
-            except (BlockingIOError, OSError):
+            # Open in read-write, non-blocking mode to prevent hanging if host is disconnected
+            # and to allow draining the OUT buffer
+            self.fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        except OSError as e:
+            print(f"Error writing to {self.path}: {e}")
+            return False
+        return True
+
+    def write(self, report):
+        """Writes a single report. Returns False if it could not be written."""
+        # Drain any pending OUT reports (e.g. LED statuses) to prevent gadget freeze
+        try:
+            while os.read(self.fd, 8):
                 pass
-            
-            os.write(fd, report)
-        finally:
-            os.close(fd)
-    except IOError as e:
-        print(f"Error writing to {HID_DEV}: {e}")
-
-def send_key(char):
-    if char not in KEY_MAP:
-        # Fallback or ignore unknown chars
-        return
-    
-    mod, code = KEY_MAP[char]
-    
-    # 8 byte report: 
-    # Byte 0: Modifier (2=Left Shift)
-    # Byte 1: Reserved (0)
-    # Byte 2: Keycode
-    # Byte 3-7: Zeros
-    
-    report = bytearray([mod, 0, code, 0, 0, 0, 0, 0])
-    write_report(report)
-    
-    # Hold key for a bit so host sees it
-    time.sleep(0.02)
-    
-    # Release key
-    write_report(bytearray([0]*8))
-    
-    # Small delay between keystrokes to prevent buffer overruns on host
-    time.sleep(0.018) 
+        except OSError:
+            pass
+
+        # The gadget only queues one report; retry briefly while the host collects it
+        deadline = time.monotonic() + WRITE_TIMEOUT
+        while True:
+            try:
+                os.write(self.fd, report)
+                return True
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    print(f"Error writing to {self.path}: host is not reading reports")
+                    return False
+                time.sleep(0.0005)
+            except OSError as e:
+                print(f"Error writing to {self.path}: {e}")
+                return False
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# Device opened by play_reports for the buffer being typed from this process
+_hid = None
+
+def write_report(report):
+    """Writes a single report to the open HID device. Returns False if it could not be written."""
+    if _hid is None or not _hid.write(report):
+        return False
+    session_trace.hid(report)
+    return True
+
+
+def parse_chord(spec):
+    """
+    Parses a key chord such as "enter", "ctrl+c" or "ctrl+shift+left" into a
+    (modifier, usage_code) tuple. Raises ValueError for unknown keys.
+    """
+    # The '+' character itself is written as "+" or "ctrl++"
+    if spec == '+' or spec.endswith('++'):
+        modifiers = spec[:-2].split('+') if len(spec) > 1 else []
+        key = '+'
+    else:
+        *modifiers, key = spec.split('+')
+
+    mod = 0
+    for name in modifiers:
+        name = name.strip().lower()
+        if name not in MODIFIERS:
+            raise ValueError(f"Unknown modifier '{name}' in '{spec}'")
+        mod |= MODIFIERS[name]
+
+    name = key.strip()
+    lower = name.lower()
+    if lower in SPECIAL_KEYS:
+        return mod, SPECIAL_KEYS[lower]
+    if lower in MODIFIERS:
+        # A bare modifier tap, e.g. "gui" to open the start menu
+        return mod | MODIFIERS[lower], 0
+    if key in KEY_MAP:
+        char_mod, code = KEY_MAP[key]
+        return mod | char_mod, code
+    raise ValueError(f"Unknown key '{name}' in '{spec}'")
+
+def key_reports(mod, code):
+    """Returns the press + release reports for a single key as bytes."""
+    return bytes([mod, 0, code, 0, 0, 0, 0, 0]) + RELEASE_REPORT
+
+def compile_text(text):
+    """
+    Compiles text into a buffer of press/release reports.
+    Characters not present in KEY_MAP are skipped.
+    """
+    text = normalize_text(text)
+    buffer = bytearray()
+    for char in text:
+        if char in KEY_MAP:
+            buffer += key_reports(*KEY_MAP[char])
+    return bytes(buffer)
+
+def compile_typing(text):
+    """
+    Compiles text into a report buffer plus the gap after each report:
+    each key is held for KEY_HOLD, then released for KEY_GAP (plus
+    SENTENCE_PAUSE after sentence-ending punctuation).
+    """
+    text = normalize_text(text)
+    buffer = bytearray()
+    gaps = []
+    for char in text:
+        if char not in KEY_MAP:
+            continue
+        buffer += key_reports(*KEY_MAP[char])
+        gaps.append(KEY_HOLD)
+        gaps.append(KEY_GAP + (SENTENCE_PAUSE if char in SENTENCE_END else 0))
+    return bytes(buffer), gaps
+
+def run_schedule(buffer, gaps, write=None, sleep_until=None):
+    """
+    Writes each report at an absolute deadline (start + sum of previous gaps),
+    so time spent writing does not push back the reports after it.
+    Returns a list of (deadline, actual write time) pairs.
+    If a write fails the schedule stops, after trying to release all keys so
+    the host is not left auto-repeating a held key.
+    """
+    if write is None:
+        write = write_report
+    if sleep_until is None:
+        sleep_until = lambda deadline: time.sleep(max(0.0, deadline - time.monotonic()))
+
+    timings = []
+    deadline = time.monotonic()
+    for i, offset in enumerate(range(0, len(buffer), 8)):
+        sleep_until(deadline)
+        actual = time.monotonic()
+        if write(buffer[offset:offset + 8]) is False:
+            write(RELEASE_REPORT)
+            break
+        timings.append((deadline, actual))
+        deadline += gaps[i]
+    return timings
+
+def timing_stats(timings):
+    """
+    Summarizes (deadline, actual) pairs: how late each report was, and how far
+    each interval between reports was from the scheduled one. In seconds.
+    """
+    if not timings:
+        return None
+    lateness = sorted(actual - deadline for deadline, actual in timings)
+    errors = sorted(abs((a2 - a1) - (d2 - d1)) for (d1, a1), (d2, a2) in zip(timings, timings[1:])) or [0.0]
+    pick = lambda values, q: values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        "reports": len(timings),
+        "elapsed": timings[-1][1] - timings[0][1],
+        "late_p50": pick(lateness, 0.5),
+        "late_p99": pick(lateness, 0.99),
+        "late_max": lateness[-1],
+        "interval_error_p50": pick(errors, 0.5),
+        "interval_error_p99": pick(errors, 0.99),
+        "interval_error_max": errors[-1],
+    }
+
+def print_timing(stats):
+    ms = lambda v: f"{v * 1000:.2f}ms"
+    print(f"Typing: {stats['reports']} reports in {stats['elapsed']:.2f}s, "
+          f"lateness p50 {ms(stats['late_p50'])} p99 {ms(stats['late_p99'])} max {ms(stats['late_max'])}, "
+          f"interval error p50 {ms(stats['interval_error_p50'])} p99 {ms(stats['interval_error_p99'])} "
+          f"max {ms(stats['interval_error_max'])}")
+
+def play_in_process(buffer, gaps):
+    """Runs the schedule from this process, with the HID device opened once for the whole buffer."""
+    global _hid
+    writer = HidWriter(HID_DEV)
+    _hid = writer if writer.open() else None
+    try:
+        return run_schedule(buffer, gaps)
+    finally:
+        _hid = None
+        writer.close()
+
+def play_reports(buffer, gaps):
+    """
+    Plays a compiled report buffer, through the typing process if one is running.
+    Returns True if every report was written, False if typing stopped early or
+    never started (e.g. no HID device, or the host stopped reading).
+    """
+    if not buffer:
+        return True
+
+    stats = typist.play(buffer, gaps) if typist else None
+    if stats is not None:
+        # Trace the reports with the times the typing process wrote them
+        for i, written_at in enumerate(stats.pop("times", [])):
+            session_trace.hid(buffer[i * 8:i * 8 + 8], at=written_at)
+    else:
+        # No typing process, or the job never reached it: write from this process
+        stats = timing_stats(play_in_process(buffer, gaps))
+
+    if stats and stats["reports"]:
+        print_timing(stats)
+    return bool(stats) and stats["reports"] == len(buffer) // 8
+
+def write_reports(buffer, interval=REPORT_INTERVAL):
+    """
+    Writes a precompiled buffer of 8 byte reports with a fixed gap between them.
+    Returns True if every report was written.
+    """
+    return play_reports(buffer, [interval] * (len(buffer) // 8))
 
 
 # Common substitutions for smart quotes, dashes, etc. produced by LLMs
@@ -105,18 +310,15 @@ SMART_REPLACEMENTS = {
     '\u00A0': ' ',
 }
 
-def type_string(text):
+def normalize_text(text):
     # Normalize text to ASCII-compatible characters
     for old, new in SMART_REPLACEMENTS.items():
         text = text.replace(old, new)
+    return text
 
-    for char in text:
-        send_key(char)
-        # Extra delay after sentence-ending punctuation to allow host processing (e.g. auto-capitalization)
-        # Small delay between keystrokes to prevent buffer overruns on host
-        time.sleep(0.002) 
-        if char in ['.', '!', '?', '\n']:
-            time.sleep(0.1)
+def type_string(text):
+    """Types text. Returns True if all of it was written."""
+    return play_reports(*compile_typing(text))
 
 if __name__ == "__main__":
     print("Testing keyboard mapper...")
@@ -1,4 +1,5 @@
 import os
+import session_trace
 from groq import Groq
 from dotenv import load_dotenv
 
@@ -8,6 +9,13 @@ load_dotenv()
 
 API_KEY = os.getenv("GROQ_API_KEY")
 
+# process_audio reports failures as text rather than raising
+ERROR_PREFIX = "Error: "
+NO_CONTENT = "No response content."
+
+def is_error_response(text):
+    return text.startswith(ERROR_PREFIX) or text == NO_CONTENT
+
 class LLMClient:
     def __init__(self):
         if not API_KEY:
@@ -20,18 +28,22 @@ class LLMClient:
         Transcribes audio using Groq (Whisper) and then processes the text with an LLM.
         """
         if not os.path.exists(audio_path):
-            return "Error: Audio file not found."
+            return ERROR_PREFIX + "Audio file not found."
             
+        # The call in progress, so a failure can be traced in its place
+        kind = "transcription"
         try:
             print(f"Reading audio: {audio_path}...")
             
             # 1. Transcribe Audio
-            with open(audio_path, "rb") as file:
+            with open(audio_path, "rb") as file, session_trace.stage("transcribe"):
                 transcription = self.client.audio.transcriptions.create(
                     file=(audio_path, file.read()),
                     model="whisper-large-v3-turbo",
                     response_format="text"
                 )
+            session_trace.response("transcription", transcription)
+            kind = "completion"
             
             print(f"DEBUG: Transcription: {transcription}")
 
@@ -52,23 +64,28 @@ class LLMClient:
                 }
             ]
 
-            completion = self.client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=0.5,
-                max_completion_tokens=1024,
-                top_p=1,
-                stop=None,
-                stream=False,
-            )
+            with session_trace.stage("complete"):
+                completion = self.client.chat.completions.create(
+                    model="llama-3.3-70b-versatile",
+                    messages=messages,
+                    temperature=0.5,
+                    max_completion_tokens=1024,
+                    top_p=1,
+                    stop=None,
+                    stream=False,
+                )
             
             if completion.choices:
-                return completion.choices[0].message.content
-            return "No response content."
+                content = completion.choices[0].message.content
+                session_trace.response("completion", content)
+                return content
+            session_trace.response("completion", "")
+            return NO_CONTENT
 
         except Exception as e:
             print(f"Error calling Groq: {e}")
-            return f"Error: {str(e)}"
+            session_trace.error(kind, e)
+            return f"{ERROR_PREFIX}{str(e)}"
     # Test stub
     # client = LLMClient()
     pass
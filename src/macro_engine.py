@@ -0,0 +1,253 @@
+
+import os
+import re
+import json
+import time
+import struct
+from ctypes import CDLL, get_errno
+from keyboard_mapper import parse_chord, key_reports, compile_text
+
+# Macro configuration
+# Maps a trigger key (or chord of evdev key names) to text and/or named keys.
+# Text may reference environment variables as ${NAME}, resolved at load time.
+#
+# {
+#     "KEY_W": ["${SAVED_PASSWORD}", {"key": "enter"}],
+#     "KEY_E": "${SAVED_EMAIL}",
+#     "KEY_LEFTCTRL+KEY_T": [{"key": "ctrl+a"}, "Hello", {"key": "tab"}]
+# }
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG = os.path.join(PROJECT_ROOT, "macros.json")
+
+# Used when no config file exists, matching the original W/E behaviour
+DEFAULT_MACROS = {
+    "KEY_W": ["${SAVED_PASSWORD}", {"key": "enter"}],
+    "KEY_E": "${SAVED_EMAIL}",
+}
+
+# Right-hand modifiers are treated the same as the left-hand ones in triggers
+MODIFIER_ALIASES = {
+    "KEY_RIGHTCTRL": "KEY_LEFTCTRL",
+    "KEY_RIGHTSHIFT": "KEY_LEFTSHIFT",
+    "KEY_RIGHTALT": "KEY_LEFTALT",
+    "KEY_RIGHTMETA": "KEY_LEFTMETA",
+}
+
+# How often to stat the config when inotify is unavailable
+POLL_INTERVAL = 2.0
+
+ENV_PATTERN = re.compile(r"\$\{(\w+)\}")
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatch:
+    """
+    Watches a single file for changes using inotify through libc.
+    The parent directory is watched so that editors which replace the file
+    (write to a temp file, then rename) are picked up too.
+    """
+    def __init__(self, path):
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.filename = os.path.basename(path)
+        self.libc = CDLL("libc.so.6", use_errno=True)
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), "inotify_init1 failed")
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.directory), mask)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(get_errno(), f"inotify_add_watch failed for {self.directory}")
+
+    def fileno(self):
+        return self.fd
+
+    def changed(self):
+        """Drains pending events. Returns True if any of them concern the watched file."""
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                if name == self.filename:
+                    changed = True
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MacroEngine:
+    def __init__(self, config_path=None, key_codes=None):
+        """
+        config_path defaults to $MACRO_CONFIG, then macros.json in the project root.
+        key_codes maps evdev key names to codes. Defaults to evdev.ecodes.ecodes.
+        """
+        if config_path is None:
+            config_path = os.getenv("MACRO_CONFIG", DEFAULT_CONFIG)
+        if key_codes is None:
+            from evdev import ecodes
+            key_codes = ecodes.ecodes
+
+        self.config_path = config_path
+        self.key_codes = key_codes
+        self.key_names = {}
+        for name, code in key_codes.items():
+            if name.startswith("KEY_"):
+                self.key_names.setdefault(code, MODIFIER_ALIASES.get(name, name))
+
+        self.macros = {}
+        self.held = set()
+        self.last_mtime = None
+        self.last_poll = 0.0
+
+        try:
+            self.watch = InotifyWatch(config_path)
+        except OSError as e:
+            print(f"Warning: inotify unavailable ({e}). Polling {config_path} instead.")
+            self.watch = None
+
+        self.reload()
+
+    def fileno(self):
+        """Returns the inotify fd to select on, or None if polling is used."""
+        return self.watch.fileno() if self.watch else None
+
+    def _read_config(self):
+        if not os.path.exists(self.config_path):
+            print(f"Macro config {self.config_path} not found. Using default macros.")
+            return DEFAULT_MACROS
+        with open(self.config_path, "r") as f:
+            return json.load(f)
+
+    def _parse_trigger(self, spec):
+        keys = []
+        for name in spec.split("+"):
+            name = name.strip().upper()
+            if not name.startswith("KEY_"):
+                name = "KEY_" + name
+            if name not in self.key_codes:
+                raise ValueError(f"Unknown trigger key '{name}'")
+            # Resolve through the code so aliased names (e.g. KEY_MUTE / KEY_MIN_INTERESTING) match
+            keys.append(self.key_names[self.key_codes[name]])
+        return frozenset(keys)
+
+    def _expand_env(self, text):
+        def replace(match):
+            value = os.getenv(match.group(1))
+            if value is None:
+                raise ValueError(f"{match.group(1)} not found in environment")
+            return value
+        return ENV_PATTERN.sub(replace, text)
+
+    def compile_macro(self, value):
+        """
+        Compiles a macro value (a string, or a list of strings and {"key": chord}
+        steps) into a buffer of HID reports.
+        """
+        steps = value if isinstance(value, list) else [value]
+        buffer = b""
+        for step in steps:
+            if isinstance(step, str):
+                buffer += compile_text(self._expand_env(step))
+            elif isinstance(step, dict) and "key" in step:
+                buffer += key_reports(*parse_chord(step["key"]))
+            elif isinstance(step, dict) and "text" in step:
+                buffer += compile_text(self._expand_env(step["text"]))
+            else:
+                raise ValueError(f"Invalid macro step: {step!r}")
+        return buffer
+
+    def reload(self):
+        """
+        Loads and compiles all macros. On a bad config the previous macros are kept.
+        """
+        try:
+            config = self._read_config()
+            if not isinstance(config, dict):
+                raise ValueError("Macro config must be a JSON object")
+        except (OSError, ValueError) as e:
+            print(f"Error loading macros from {self.config_path}: {e}")
+            return
+
+        macros = {}
+        for trigger, value in config.items():
+            try:
+                macros[self._parse_trigger(trigger)] = self.compile_macro(value)
+            except ValueError as e:
+                print(f"Warning: Skipping macro '{trigger}': {e}")
+
+        self.macros = macros
+        try:
+            self.last_mtime = os.stat(self.config_path).st_mtime
+        except OSError:
+            self.last_mtime = None
+        print(f"Loaded {len(macros)} macros.")
+
+    def reload_if_changed(self):
+        """
+        Reloads the config if it changed. With inotify this should be called when
+        fileno() is readable; otherwise it is rate limited to POLL_INTERVAL.
+        """
+        if self.watch:
+            if self.watch.changed():
+                print("Macro config changed. Reloading...")
+                self.reload()
+            return
+
+        now = time.monotonic()
+        if now - self.last_poll < POLL_INTERVAL:
+            return
+        self.last_poll = now
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self.last_mtime:
+            print("Macro config changed. Reloading...")
+            self.reload()
+
+    def key_event(self, code, value):
+        """
+        Tracks held keys and returns the compiled report buffer if this key press
+        completes a macro trigger, otherwise None.
+        """
+        name = self.key_names.get(code)
+        if name is None:
+            return None
+
+        if value == 0:
+            self.held.discard(name)
+            return None
+        if value != 1:
+            # Ignore auto-repeat so holding a key does not replay the macro
+            return None
+
+        self.held.add(name)
+        return self.macros.get(frozenset(self.held))
+
+    def close(self):
+        if self.watch:
+            self.watch.close()
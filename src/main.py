@@ -8,8 +8,13 @@ import evdev
 from select import select
 from evdev import InputDevice, categorize, ecodes
 from audio_handler import AudioHandler
-from llm_client import LLMClient
-from keyboard_mapper import type_string
+from llm_client import LLMClient, is_error_response
+import keyboard_mapper
+from keyboard_mapper import type_string, write_reports
+from typing_process import TypingProcess
+from macro_engine import MacroEngine
+from edit_mode import EditSession
+import session_trace
 from ctypes import *
 from contextlib import contextmanager
 from dotenv import load_dotenv
@@ -46,9 +51,13 @@ INPUT_MAP = {
     ecodes.KEY_F5: "The following text was transcribed by a an AI voice recorder. Rephrase the content in the style of Shakespeare. Return only the rephrased text.",
 }
 
+# Toggles minimal-keystroke edit mode: responses are typed as an edit of the previous output
+EDIT_MODE_KEY = ecodes.KEY_F9
+
 # State
 current_instruction = None
 is_processing = False
+edit_mode = os.getenv("EDIT_MODE", "0") == "1"
 
 def find_device():
     print("Scanning for all input devices...")
@@ -164,6 +173,10 @@ def monitor_usb_connection():
 def timeout_handler(signum, frame):
     raise TimeoutError("LLM Request Timed Out")
 
+def terminate_handler(signum, frame):
+    # systemd stops the service with SIGTERM; clean up the same way as on Ctrl+C
+    raise KeyboardInterrupt
+
 
 def reinitialize_gadget():
     try:
@@ -182,19 +195,33 @@ def reinitialize_gadget():
         print(f"Warning: Failed to configure USB gadget: {e}")
 
 def main():
-    global current_instruction, is_processing
+    global current_instruction, is_processing, edit_mode
 
     # Initialize handlers
     print("Initializing services...")
+
+    # Optional session trace for replay (see src/trace_replay.py)
+    trace_file = os.getenv("TRACE_FILE")
+    if trace_file:
+        session_trace.start(trace_file, {"edit_mode": edit_mode})
     
     # Configure USB Gadget
     reinitialize_gadget()
 
+    # Type from a dedicated process so HID timing doesn't compete for the GIL
+    typist = None
+    if os.getenv("TYPING_PROCESS", "1") == "1":
+        typist = TypingProcess(keyboard_mapper.HID_DEV)
+        typist.start()
+        keyboard_mapper.typist = typist
+
     # Start Monitor Thread
     monitor_thread = threading.Thread(target=monitor_usb_connection, daemon=True)
     monitor_thread.start()
 
     llm_client = LLMClient()
+    macros = MacroEngine()
+    edit_session = EditSession()
     
     # Initialize AudioHandler with ALSA suppression
     with no_alsa_err():
@@ -215,6 +242,7 @@ def main():
     except Exception as e:
         print(f"Warning: Could not grab device: {e}")
 
+    previous_terminate_handler = signal.signal(signal.SIGTERM, terminate_handler)
     try:
         while True:
             # 1. Handle Audio Recording
@@ -232,35 +260,42 @@ def main():
                 
                 # We can use read_loop() if we use async, but here we are synchronous.
                 # Let's use select on the file descriptor with a timeout of 0
-                r, w, x = select([device.fd], [], [], 0.0)
-                if r:
+                fds = [device.fd]
+                if macros.fileno() is not None:
+                    fds.append(macros.fileno())
+                r, w, x = select(fds, [], [], 0.0)
+
+                # Hot-reload macros when the config file changes (inotify, or polled)
+                if macros.fileno() is None or macros.fileno() in r:
+                    macros.reload_if_changed()
+
+                if device.fd in r:
                     for event in device.read():
+                        session_trace.input_event(event)
                         if event.type == ecodes.EV_KEY:
-                            if event.value == 1: # Key Down
+                            macro = macros.key_event(event.code, event.value)
+                            if macro and not is_processing and not audio_handler.is_recording:
+                                print(f"Button {event.code} pressed. Playing macro...")
+                                # Only the timing is traced; macros may type passwords
+                                with session_trace.stage("macro"), session_trace.redacted():
+                                    write_reports(macro)
+                                # The cursor is no longer at the end of the last response
+                                edit_session.reset()
+
+                            elif event.value == 1: # Key Down
                                 if event.code in INPUT_MAP:
                                     instruction = INPUT_MAP[event.code]
                                     if not is_processing and not audio_handler.is_recording:
                                         print(f"Button {event.code} pressed. Recording...")
                                         current_instruction = instruction
+                                        session_trace.begin("record")
                                         with no_alsa_err():
                                             audio_handler.start_recording()
+
+                                elif event.code == EDIT_MODE_KEY:
+                                    edit_mode = not edit_mode
+                                    print(f"Edit mode {'enabled' if edit_mode else 'disabled'}.")
                                             
-                            elif event.code == ecodes.KEY_W:
-                                print(f"Button {event.code} pressed. Typing password...")
-                                password = os.getenv("SAVED_PASSWORD")
-                                if password:
-                                    type_string(password + "\n")
-                                else:
-                                    print("Warning: SAVED_PASSWORD not found in environment.")
-
-                            elif event.code == ecodes.KEY_E:
-                                print(f"Button {event.code} pressed. Typing email...")
-                                email = os.getenv("SAVED_EMAIL")
-                                if email:
-                                    type_string(email)
-                                else:
-                                    print("Warning: SAVED_EMAIL not found in environment.")
-                                    
                             elif event.code == ecodes.KEY_F10:
                                 print(f"Button F10 pressed. Manually reinitializing USB Gadget...")
                                 reinitialize_gadget()
@@ -272,6 +307,8 @@ def main():
                                     
                                     print("Stopping recording...")
                                     audio_path = audio_handler.stop_recording()
+                                    session_trace.end("record")
+                                    session_trace.begin("respond")
                                     
                                     if audio_path:
                                         print("Sending to LLM...")
@@ -287,7 +324,17 @@ def main():
                                             
                                             print(f"DEBUG: Response from Groq:\n{response}")
                                             print(f"Response received ({len(response)} chars). Typing...")
-                                            type_string(response)
+                                            with session_trace.stage("type"):
+                                                if is_error_response(response):
+                                                    # Never edit the previous output into an error message
+                                                    type_string(response)
+                                                    edit_session.reset()
+                                                elif not (edit_mode and edit_session.type(response)):
+                                                    if type_string(response):
+                                                        edit_session.remember(response)
+                                                    else:
+                                                        # Only part of it (or none) reached the host
+                                                        edit_session.reset()
                                             print("Done.")
                                             
                                         except TimeoutError:
@@ -299,6 +346,7 @@ def main():
                                     else:
                                         print("No audio recorded.")
                                     
+                                    session_trace.end("respond")
                                     current_instruction = None
                                     is_processing = False
             except BlockingIOError:
@@ -315,7 +363,13 @@ def main():
     except Exception as e:
         print(f"Error in event loop: {e}")
     finally:
+        signal.signal(signal.SIGTERM, previous_terminate_handler)
         audio_handler.cleanup()
+        macros.close()
+        session_trace.stop()
+        if typist:
+            typist.close()
+            keyboard_mapper.typist = None
         try:
             device.ungrab()
         except:
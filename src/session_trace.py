@@ -0,0 +1,257 @@
+
+import os
+import json
+import time
+import struct
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Session trace format
+# A trace file holds one session per service start, appended one after the
+# other so a restart never overwrites the trace of the run that crashed.
+# Each session is a header followed by a flat list of records:
+#   Header: MAGIC, then <H version> <d wall clock start time> <I config length>
+#           and the config as JSON (settings that change what a replay types)
+#   Record: <B type> <Q microseconds since start> <I payload length> <payload>
+# Payloads:
+#   INPUT     <H type> <H code> <i value> of an evdev event
+#   PCM       raw audio chunk as read from the stream
+#   RESPONSE  kind (e.g. "transcription") NUL text, utf-8
+#   ERROR     kind NUL error message, utf-8, for an API call that raised
+#   HID       8 byte keyboard report
+#   BEGIN/END stage name, utf-8
+#
+# Records are in the order they were written, each with a single unbuffered
+# write so a killed service loses at most the record it was writing. HID
+# reports typed by the typing process are written once the job ends, stamped
+# with the times the child wrote them (CLOCK_MONOTONIC is shared between processes).
+#
+# Traces hold raw audio and everything typed, so they are only readable by
+# their owner, and reports typed inside redacted() (macros) are left out.
+
+MAGIC = b"PIKT"
+VERSION = 2
+HEADER = struct.Struct("<HdI")
+RECORD = struct.Struct("<BQI")
+INPUT_EVENT = struct.Struct("<HHi")
+
+INPUT = 1
+PCM = 2
+RESPONSE = 3
+HID = 4
+BEGIN = 5
+END = 6
+ERROR = 7
+
+Record = namedtuple("Record", ["type", "time", "payload"])
+Session = namedtuple("Session", ["started", "config", "records"])
+
+
+class TraceWriter:
+    def __init__(self, path, config=None):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        # O_CREAT keeps the mode of an existing file, so tighten it explicitly
+        os.fchmod(self.fd, 0o600)
+        try:
+            # Drop a record left half written by a killed run before appending after it
+            with os.fdopen(os.dup(self.fd), "rb") as f:
+                _, valid = _parse(f, path, payloads=False)
+            os.ftruncate(self.fd, valid)
+        except ValueError:
+            os.close(self.fd)
+            raise
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        config = json.dumps(config or {}).encode()
+        os.write(self.fd, MAGIC + HEADER.pack(VERSION, time.time(), len(config)) + config)
+
+    def write(self, record_type, payload, at=None):
+        """Writes a record, timestamped now or at the given time.monotonic() value."""
+        micros = int(((at if at is not None else time.monotonic()) - self.start) * 1_000_000)
+        with self.lock:
+            os.write(self.fd, RECORD.pack(record_type, micros, len(payload)) + payload)
+
+    def close(self):
+        with self.lock:
+            os.close(self.fd)
+
+
+# Active writer, or None when tracing is disabled
+_writer = None
+# Set while typing something that must not be recorded
+_redacted = False
+
+def start(path, config=None):
+    """
+    Starts recording a new session at the end of the trace at path, replacing
+    any active trace. config is stored in the session header for replay.
+    """
+    global _writer
+    stop()
+    _writer = TraceWriter(path, config)
+    print(f"Recording session trace to {path}")
+
+def stop():
+    global _writer
+    if _writer:
+        _writer.close()
+        _writer = None
+
+def is_recording():
+    return _writer is not None
+
+def input_event(event):
+    if _writer:
+        _writer.write(INPUT, INPUT_EVENT.pack(event.type, event.code, event.value))
+
+def pcm(data):
+    if _writer:
+        _writer.write(PCM, bytes(data))
+
+def response(kind, text):
+    if _writer:
+        _writer.write(RESPONSE, kind.encode() + b"\0" + str(text).encode())
+
+def error(kind, message):
+    if _writer:
+        _writer.write(ERROR, kind.encode() + b"\0" + str(message).encode())
+
+def hid(report, at=None):
+    if _writer and not _redacted:
+        _writer.write(HID, bytes(report), at)
+
+@contextmanager
+def redacted():
+    """Leaves HID reports out of the trace, e.g. for macros that type passwords."""
+    global _redacted
+    _redacted = True
+    try:
+        yield
+    finally:
+        _redacted = False
+
+def begin(name):
+    if _writer:
+        _writer.write(BEGIN, name.encode())
+
+def end(name):
+    if _writer:
+        _writer.write(END, name.encode())
+
+@contextmanager
+def stage(name):
+    begin(name)
+    try:
+        yield
+    finally:
+        end(name)
+
+
+def _parse(f, path, payloads=True):
+    """
+    Parses a trace file into Sessions. Returns (sessions, length of the file up
+    to the end of the last complete record). Raises ValueError if the file is
+    not a session trace.
+    """
+    sessions = []
+    valid = 0
+    start_size = len(MAGIC) + HEADER.size
+    f.seek(0)
+    while True:
+        start = f.read(start_size)
+        if start[:len(MAGIC)] != MAGIC[:len(start)]:
+            raise ValueError(f"{path} is not a session trace")
+        if len(start) < start_size:
+            # End of file, or a header cut short
+            return sessions, valid
+        version, started, config_length = HEADER.unpack_from(start, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f"Unsupported trace version {version} in {path}")
+        config = f.read(config_length)
+        if len(config) < config_length:
+            return sessions, valid
+        session = Session(started, json.loads(config), [])
+        sessions.append(session)
+        valid = f.tell()
+
+        while True:
+            head = f.read(RECORD.size)
+            if head[:1] == MAGIC[:1]:
+                # The next session starts here
+                f.seek(valid)
+                break
+            if len(head) < RECORD.size:
+                return sessions, valid
+            record_type, micros, length = RECORD.unpack(head)
+            if payloads:
+                payload = f.read(length)
+                if len(payload) < length:
+                    # Truncated final record, e.g. the service was killed mid-write
+                    return sessions, valid
+            else:
+                payload = None
+                f.seek(length, os.SEEK_CUR)
+                if f.tell() > os.fstat(f.fileno()).st_size:
+                    return sessions, valid
+            session.records.append(Record(record_type, micros / 1_000_000, payload))
+            valid = f.tell()
+
+def read_sessions(path):
+    """Reads all sessions in a trace file, with record times in seconds since each session started."""
+    with open(path, "rb") as f:
+        sessions, _ = _parse(f, path)
+    if not sessions:
+        raise ValueError(f"{path} is not a session trace")
+    return sessions
+
+def read_session(path, session=-1):
+    """Reads one session of a trace file, by default the last one."""
+    sessions = read_sessions(path)
+    try:
+        return sessions[session]
+    except IndexError:
+        raise ValueError(f"{path} has {len(sessions)} sessions, no session {session}") from None
+
+def read_trace(path, session=-1):
+    """Reads the records of one session of a trace file, by default the last one."""
+    return read_session(path, session).records
+
+def decode_input(record):
+    """Returns (type, code, value) of an INPUT record."""
+    return INPUT_EVENT.unpack(record.payload)
+
+def decode_response(record):
+    """Returns (kind, text) of a RESPONSE or ERROR record."""
+    kind, _, text = record.payload.partition(b"\0")
+    return kind.decode(), text.decode()
+
+def hid_reports(records):
+    return [r.payload for r in records if r.type == HID]
+
+def stage_durations(records):
+    """Returns {stage name: [durations in seconds]} from BEGIN/END pairs."""
+    started = {}
+    durations = {}
+    for r in records:
+        if r.type == BEGIN:
+            started[r.payload] = r.time
+        elif r.type == END and r.payload in started:
+            name = r.payload.decode()
+            durations.setdefault(name, []).append(r.time - started.pop(r.payload))
+    return durations
+
+if __name__ == "__main__":
+    import sys
+    # Print a summary of each session in a trace file
+    names = {INPUT: "input", PCM: "pcm", RESPONSE: "response", HID: "hid", BEGIN: "begin", END: "end", ERROR: "error"}
+    for index, session in enumerate(read_sessions(sys.argv[1])):
+        print(f"Session {index}: started {time.ctime(session.started)}, config {session.config}")
+        counts = {}
+        for r in session.records:
+            counts[r.type] = counts.get(r.type, 0) + 1
+        for record_type, count in sorted(counts.items()):
+            print(f"  {names.get(record_type, record_type)}: {count}")
+        for name, values in stage_durations(session.records).items():
+            print(f"  stage {name}: n={len(values)} mean={sum(values) / len(values) * 1000:.1f}ms")
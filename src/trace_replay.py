@@ -0,0 +1,395 @@
+
+import os
+import sys
+import time
+import tty
+import argparse
+import tempfile
+import threading
+from select import select
+from collections import deque, namedtuple
+from contextlib import nullcontext
+from types import SimpleNamespace
+import session_trace
+from session_trace import INPUT, PCM, RESPONSE, ERROR
+
+# Replays a session trace through main.py with fake devices:
+#   evdev keyboard -> pipe fed from the trace's INPUT records
+#   pyaudio stream -> the trace's PCM records
+#   Groq API       -> the trace's RESPONSE records, raising its ERROR records
+#   /dev/hidg0     -> a raw pty, read back as the emitted reports
+#
+# Record a baseline on the device with TRACE_FILE=/path/session.trace in .env, then:
+#   python3 src/trace_replay.py session.trace [--session N] [--realtime] [--baseline other.trace]
+
+# Give up on a PCM record the pipeline never reads after this long
+STALL_TIMEOUT = 2.0
+
+# Stages must be this much slower than the baseline (on top of the tolerance) to fail
+MIN_SLACK = 0.005
+
+InputEvent = namedtuple("InputEvent", ["type", "code", "value"])
+ReplayResult = namedtuple("ReplayResult", ["records", "reports", "padded", "skipped"])
+
+
+class Timeline:
+    """
+    Hands out the INPUT and PCM records of a trace in order, either at the
+    recorded speed or as fast as the pipeline consumes them.
+    The device fd is readable only while the next record is a due INPUT event.
+    """
+    def __init__(self, records, realtime=False, speed=1.0):
+        self.items = [r for r in records if r.type in (INPUT, PCM)]
+        self.realtime = realtime
+        self.speed = speed
+        self.index = 0
+        self.armed = False
+        self.finished = False
+        self.padded = 0
+        self.skipped = 0
+        self.start = None
+        self.current_since = None
+        self.cond = threading.Condition()
+        self.read_fd, self.write_fd = os.pipe()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def begin(self):
+        with self.cond:
+            self.start = time.monotonic()
+            self.current_since = self.start
+            self._arm_if_due()
+        self.thread.start()
+
+    def _current(self):
+        return self.items[self.index] if self.index < len(self.items) else None
+
+    def _due(self, item):
+        if self.realtime:
+            return self.start + item.time / self.speed
+        return self.current_since
+
+    def _arm_if_due(self, force=False):
+        item = self._current()
+        if self.armed:
+            return
+        # Past the end the fd stays readable so the next read() ends the replay
+        if item is None or (item.type == INPUT and (force or time.monotonic() >= self._due(item))):
+            os.write(self.write_fd, b"x")
+            self.armed = True
+
+    def _advance(self):
+        self.index += 1
+        self.armed = False
+        self.current_since = time.monotonic()
+        self._arm_if_due()
+        self.cond.notify_all()
+
+    def read_events(self):
+        with self.cond:
+            os.read(self.read_fd, 1)
+            item = self._current()
+            if item is None:
+                # Trace exhausted; main() treats this like Ctrl+C and cleans up
+                raise KeyboardInterrupt
+            self._advance()
+            return [InputEvent(*session_trace.decode_input(item))]
+
+    def read_pcm(self, size):
+        with self.cond:
+            while True:
+                item = self._current()
+                if item is not None and item.type == PCM:
+                    remaining = self._due(item) - time.monotonic()
+                    if remaining <= 0:
+                        self._advance()
+                        return item.payload
+                    self.cond.wait(remaining)
+                    continue
+
+                # The pipeline is still recording where the trace was not;
+                # let the pending event through and pad with silence.
+                if item is not None and not self.armed:
+                    remaining = self._due(item) - time.monotonic()
+                    if remaining > 0:
+                        self.cond.wait(remaining)
+                        continue
+                    self._arm_if_due(force=True)
+                self.padded += 1
+                return bytes(size * 2)
+
+    def _run(self):
+        with self.cond:
+            while not self.finished:
+                item = self._current()
+                timeout = 0.05
+                if item is not None and item.type == INPUT and not self.armed:
+                    remaining = self._due(item) - time.monotonic()
+                    if remaining <= 0:
+                        self._arm_if_due()
+                    else:
+                        timeout = min(timeout, remaining)
+                elif item is not None and item.type == PCM:
+                    waited = time.monotonic() - max(self._due(item), self.current_since)
+                    if waited > STALL_TIMEOUT:
+                        print(f"Replay: skipping PCM record {self.index} the pipeline did not read")
+                        self.skipped += 1
+                        self._advance()
+                self.cond.wait(timeout)
+
+    def close(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class FakeInputDevice:
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self.name = "Replay Keyboard"
+        self.path = "replay"
+        self.fd = timeline.read_fd
+
+    def read(self):
+        return self.timeline.read_events()
+
+    def grab(self):
+        pass
+
+    def ungrab(self):
+        pass
+
+
+class FakeStream:
+    def __init__(self, timeline):
+        self.timeline = timeline
+
+    def read(self, size, exception_on_overflow=True):
+        return self.timeline.read_pcm(size)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePyAudio:
+    def __init__(self, timeline):
+        self.timeline = timeline
+
+    def get_device_count(self):
+        return 1
+
+    def get_device_info_by_index(self, index):
+        return {"name": "Replay USB Audio", "maxInputChannels": 1}
+
+    def open(self, **kwargs):
+        return FakeStream(self.timeline)
+
+    def get_sample_size(self, format):
+        return 2
+
+    def terminate(self):
+        pass
+
+
+class ReplayedError(Exception):
+    """An API error recorded in the trace, raised again where it happened."""
+
+
+class StubGroq:
+    """
+    Stands in for the Groq client, answering with the recorded responses and
+    failing where the recorded calls failed.
+    In realtime mode each call also takes as long as it did when recorded.
+    """
+    def __init__(self, records, realtime=False, speed=1.0):
+        self.responses = {"transcription": deque(), "completion": deque()}
+        for r in records:
+            if r.type in (RESPONSE, ERROR):
+                kind, text = session_trace.decode_response(r)
+                self.responses.setdefault(kind, deque()).append((r.type == ERROR, text))
+
+        durations = session_trace.stage_durations(records)
+        self.latencies = {
+            "transcription": deque(durations.get("transcribe", [])),
+            "completion": deque(durations.get("complete", [])),
+        }
+        self.realtime = realtime
+        self.speed = speed
+
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+
+    def _next(self, kind):
+        if self.realtime and self.latencies[kind]:
+            time.sleep(self.latencies[kind].popleft() / self.speed)
+        if not self.responses[kind]:
+            raise RuntimeError(f"Trace has no more recorded {kind} responses")
+        failed, text = self.responses[kind].popleft()
+        if failed:
+            raise ReplayedError(text)
+        return text
+
+    def _transcribe(self, **kwargs):
+        return self._next("transcription")
+
+    def _complete(self, **kwargs):
+        message = SimpleNamespace(content=self._next("completion"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeHid:
+    """A raw pty standing in for /dev/hidg0, collecting the reports written to it."""
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.buffer = b""
+        self.reports = []
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            r, _, _ = select([self.master], [], [], 0.05)
+            if not r:
+                continue
+            try:
+                self.buffer += os.read(self.master, 4096)
+            except OSError:
+                break
+            while len(self.buffer) >= 8:
+                self.reports.append(self.buffer[:8])
+                self.buffer = self.buffer[8:]
+
+    def close(self):
+        # Let the reader catch up with the last writes
+        time.sleep(0.1)
+        self.running = False
+        self.thread.join()
+        os.close(self.slave)
+        os.close(self.master)
+
+
+def replay(trace_path, realtime=False, speed=1.0, save_path=None, session=-1):
+    """
+    Runs main.main() against a session of the trace (by default the last one)
+    with fake devices and a stubbed API, and the settings it was recorded with.
+    Returns a ReplayResult with the trace recorded during the replay and the
+    reports emitted to the fake HID device.
+    """
+    import main
+    import audio_handler
+    import llm_client
+    import keyboard_mapper
+
+    recorded = session_trace.read_session(trace_path, session)
+    records = recorded.records
+    timeline = Timeline(records, realtime, speed)
+    stub = StubGroq(records, realtime, speed)
+    hid = FakeHid()
+
+    if save_path is None:
+        handle, save_path = tempfile.mkstemp(suffix=".trace")
+        os.close(handle)
+
+    def find_device():
+        timeline.begin()
+        return FakeInputDevice(timeline)
+
+    patches = [
+        (main, "reinitialize_gadget", lambda: None),
+        (main, "monitor_usb_connection", lambda: None),
+        (main, "no_alsa_err", nullcontext),
+        (main, "find_device", find_device),
+        (main, "edit_mode", recorded.config.get("edit_mode", False)),
+        # Macro output is not in the trace, so don't type it during replay either
+        (main, "write_reports", lambda buffer: None),
+        (audio_handler, "pyaudio", SimpleNamespace(PyAudio=lambda: FakePyAudio(timeline))),
+        (llm_client, "Groq", lambda api_key=None: stub),
+        (keyboard_mapper, "HID_DEV", hid.path),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    previous_trace_file = os.environ.get("TRACE_FILE")
+
+    try:
+        for module, name, value in patches:
+            setattr(module, name, value)
+        os.environ["TRACE_FILE"] = save_path
+        main.main()
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+        if previous_trace_file is None:
+            os.environ.pop("TRACE_FILE", None)
+        else:
+            os.environ["TRACE_FILE"] = previous_trace_file
+        session_trace.stop()
+        timeline.close()
+        hid.close()
+
+    return ReplayResult(session_trace.read_trace(save_path), hid.reports, timeline.padded, timeline.skipped)
+
+
+def compare(baseline, result, tolerance=0.2):
+    """
+    Compares a replay against baseline records. Prints a report and returns
+    True if the output matches and no stage is slower than the tolerance allows.
+    """
+    ok = True
+    expected = session_trace.hid_reports(baseline)
+    if result.reports == expected:
+        print(f"Output: MATCH ({len(expected)} reports)")
+    else:
+        ok = False
+        print(f"Output: MISMATCH (expected {len(expected)} reports, got {len(result.reports)})")
+        for i, (a, b) in enumerate(zip(expected, result.reports)):
+            if a != b:
+                print(f"  First difference at report {i}: expected {a.hex()}, got {b.hex()}")
+                break
+
+    if result.padded or result.skipped:
+        print(f"Warning: replay diverged from the trace ({result.padded} padded audio reads, {result.skipped} skipped)")
+
+    base_stages = session_trace.stage_durations(baseline)
+    new_stages = session_trace.stage_durations(result.records)
+    print(f"{'Stage':<12}{'Baseline':>12}{'Replay':>12}")
+    for name in sorted(set(base_stages) | set(new_stages)):
+        base = base_stages.get(name)
+        new = new_stages.get(name)
+        base_mean = sum(base) / len(base) if base else None
+        new_mean = sum(new) / len(new) if new else None
+        status = ""
+        if base_mean is not None and new_mean is not None:
+            if new_mean > base_mean * (1 + tolerance) + MIN_SLACK:
+                status = "REGRESSION"
+                ok = False
+        fmt = lambda v: f"{v * 1000:.1f}ms" if v is not None else "-"
+        print(f"{name:<12}{fmt(base_mean):>12}{fmt(new_mean):>12}  {status}")
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a session trace and check for regressions.")
+    parser.add_argument("trace", help="Trace recorded with TRACE_FILE")
+    parser.add_argument("--session", type=int, default=-1, help="Session of the trace to replay (defaults to the last)")
+    parser.add_argument("--realtime", action="store_true", help="Replay at recorded speed instead of as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed multiplier for --realtime")
+    parser.add_argument("--baseline", help="Trace to compare against (defaults to the replayed trace)")
+    parser.add_argument("--save", help="Save the replay's own trace, e.g. as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown per stage")
+    args = parser.parse_args()
+
+    result = replay(args.trace, args.realtime, args.speed, args.save, args.session)
+    if args.baseline:
+        baseline = session_trace.read_trace(args.baseline)
+    else:
+        baseline = session_trace.read_trace(args.trace, args.session)
+    sys.exit(0 if compare(baseline, result, args.tolerance) else 1)
@@ -0,0 +1,218 @@
+
+import os
+import sys
+import time
+import struct
+import ctypes
+import subprocess
+from array import array
+from select import select
+from keyboard_mapper import RELEASE_REPORT, WRITE_TIMEOUT, HidWriter, run_schedule, timing_stats
+
+# Real-time typing process
+# HID writes run in a separate process so their timing does not share the GIL
+# with the Groq client, audio capture and the USB monitor thread. The parent
+# sends compiled report buffers over a pipe; the child writes each report at
+# an absolute deadline and sends back timing stats.
+#
+# Protocol (stdin/stdout of the child):
+#   Job:    <I report count> reports (8 bytes each) gaps (float64 each)
+#   Result: <I reports written> then STATS doubles, then the write time
+#           (time.monotonic()) of each report written as float64
+
+JOB_HEADER = struct.Struct("<I")
+STATS_FIELDS = ["elapsed", "late_p50", "late_p99", "late_max",
+                "interval_error_p50", "interval_error_p99", "interval_error_max"]
+RESULT = struct.Struct("<I" + "d" * len(STATS_FIELDS))
+
+# SCHED_FIFO priority for the child; 0 leaves the default scheduler
+TYPING_PRIORITY = int(os.getenv("TYPING_PRIORITY", "50"))
+# CPU to pin the child to; defaults to the last core
+TYPING_CPU = os.getenv("TYPING_CPU")
+
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class TypingProcess:
+    """Parent side: starts the child and hands it report buffers to play."""
+    def __init__(self, hid_path):
+        self.hid_path = hid_path
+        self.proc = None
+
+    def start(self):
+        script = os.path.abspath(__file__)
+        self.proc = subprocess.Popen([sys.executable, script, self.hid_path],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        print(f"Typing process started (PID {self.proc.pid}).")
+
+    def _read_exact(self, size, timeout):
+        fd = self.proc.stdout.fileno()
+        data = b""
+        deadline = time.monotonic() + timeout
+        while len(data) < size:
+            r, _, _ = select([fd], [], [], max(0.0, deadline - time.monotonic()))
+            if not r:
+                raise TimeoutError("Typing process did not respond")
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                raise EOFError("Typing process exited")
+            data += chunk
+        return data
+
+    def play(self, buffer, gaps):
+        """
+        Plays buffer in the child and waits for it to finish. Returns the timing
+        stats plus the write time of each report ({"reports": 0} if nothing could
+        be written or the child failed mid-job), or None if the job never reached
+        the child and the caller should type it instead.
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            print("Typing process not running. Restarting...")
+            self.start()
+
+        count = len(buffer) // 8
+        try:
+            self.proc.stdin.write(JOB_HEADER.pack(count) + bytes(buffer) + array("d", gaps[:count]).tobytes())
+            self.proc.stdin.flush()
+        except OSError as e:
+            print(f"Error sending to typing process: {e}")
+            self.close()
+            return None
+
+        # From here the child may have typed part of the buffer, so never retype it
+        try:
+            values = RESULT.unpack(self._read_exact(RESULT.size, sum(gaps) + count * WRITE_TIMEOUT + 5))
+            times = array("d")
+            times.frombytes(self._read_exact(values[0] * 8, 5))
+        except (OSError, EOFError, TimeoutError) as e:
+            print(f"Error in typing process: {e}. Typing stopped.")
+            self.close()
+            self.release_keys()
+            return {"reports": 0}
+
+        if values[0] == 0:
+            return {"reports": 0}
+        stats = dict(zip(STATS_FIELDS, values[1:]))
+        stats["reports"] = values[0]
+        stats["times"] = list(times)
+        return stats
+
+    def release_keys(self):
+        """Releases any key the child may have left held down."""
+        writer = HidWriter(self.hid_path)
+        if writer.open():
+            try:
+                writer.write(RELEASE_REPORT)
+            finally:
+                writer.close()
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=2)
+        except Exception:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+
+def make_sleep_until():
+    """
+    Returns a function sleeping until an absolute time.monotonic() deadline,
+    using clock_nanosleep(TIMER_ABSTIME) where available.
+    """
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        clock_nanosleep = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return lambda deadline: time.sleep(max(0.0, deadline - time.monotonic()))
+
+    def sleep_until(deadline):
+        ts = Timespec(int(deadline), int((deadline % 1) * 1_000_000_000))
+        # Returns EINTR if interrupted by a signal; keep sleeping to the same deadline
+        while clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(ts), None) == 4:
+            pass
+    return sleep_until
+
+def setup_realtime():
+    """Pins the process to a CPU, raises it to SCHED_FIFO and locks its memory, where allowed."""
+    try:
+        cpu = int(TYPING_CPU) if TYPING_CPU is not None else max(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpu})
+        print(f"Typing process pinned to CPU {cpu}.")
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Warning: Could not set typing process CPU affinity: {e}")
+
+    if TYPING_PRIORITY > 0:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(TYPING_PRIORITY))
+            print(f"Typing process running with SCHED_FIFO priority {TYPING_PRIORITY}.")
+        except (OSError, AttributeError) as e:
+            print(f"Warning: Could not set SCHED_FIFO for typing process: {e}")
+
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            print(f"Warning: Could not lock typing process memory: {os.strerror(ctypes.get_errno())}")
+    except (OSError, AttributeError):
+        pass
+
+def read_exact(fd, size):
+    data = b""
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+def serve(hid_path):
+    """Child side: plays jobs from stdin until it is closed."""
+    # Keep stdout for results; anything printed goes to stderr (the service log)
+    results = os.dup(1)
+    os.dup2(2, 1)
+    jobs = sys.stdin.fileno()
+
+    setup_realtime()
+    sleep_until = make_sleep_until()
+    writer = HidWriter(hid_path)
+
+    while True:
+        header = read_exact(jobs, JOB_HEADER.size)
+        if header is None:
+            break
+        (count,) = JOB_HEADER.unpack(header)
+        buffer = read_exact(jobs, count * 8)
+        gaps = array("d")
+        gaps.frombytes(read_exact(jobs, count * 8))
+
+        timings = []
+        if writer.open():
+            try:
+                timings = run_schedule(buffer, gaps, writer.write, sleep_until)
+            finally:
+                writer.close()
+
+        stats = timing_stats(timings)
+        if stats:
+            values = [stats[field] for field in STATS_FIELDS]
+            times = array("d", [actual for _, actual in timings])
+            write_all(results, RESULT.pack(stats["reports"], *values) + times.tobytes())
+        else:
+            write_all(results, RESULT.pack(0, *[0.0] * len(STATS_FIELDS)))
+
+if __name__ == "__main__":
+    serve(sys.argv[1])
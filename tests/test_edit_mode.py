@@ -0,0 +1,138 @@
+import sys
+import os
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import edit_mode
+import keyboard_mapper
+from edit_mode import EditSession, myers_diff, plan_edit, keystrokes
+from keyboard_mapper import KEY_MAP, SPECIAL_KEYS
+
+REVERSE_MAP = {v: k for k, v in KEY_MAP.items()}
+
+def simulate(old, buffer):
+    """Applies a report buffer to old, with the cursor starting at the end."""
+    text = list(old)
+    cursor = len(text)
+    for offset in range(0, len(buffer), 16):
+        mod, code = buffer[offset], buffer[offset + 2]
+        if (mod, code) == (0, SPECIAL_KEYS['left']):
+            cursor -= 1
+        elif (mod, code) == (0, SPECIAL_KEYS['right']):
+            cursor += 1
+        elif (mod, code) == (0, SPECIAL_KEYS['backspace']):
+            cursor -= 1
+            del text[cursor]
+        elif (mod, code) == (0, SPECIAL_KEYS['delete']):
+            del text[cursor]
+        else:
+            text.insert(cursor, REVERSE_MAP[(mod, code)])
+            cursor += 1
+        assert 0 <= cursor <= len(text)
+    assert cursor == len(text), "cursor should end after the new text"
+    return "".join(text)
+
+CASES = [
+    ("", "Hello."),
+    ("Hello.", ""),
+    ("Hello world.", "Hello world."),
+    ("Hello world.", "Hello world!"),
+    ("The quick brown fox.", "A quick brown fox."),
+    ("Meet me at 5pm.\nThanks", "Meet me at 6pm.\nThanks,\nSam"),
+    ("abcabba", "cbabac"),
+]
+
+def test_diff():
+    for old, new in CASES:
+        runs = myers_diff(old, new)
+        assert "".join(t for op, t in runs if op != '+') == old
+        assert "".join(t for op, t in runs if op != '-') == new
+    # Too far apart to be worth diffing
+    assert myers_diff("a" * 50, "b" * 50, max_distance=10) is None
+    print("MATCH")
+
+def test_plan():
+    for old, new in CASES:
+        buffer = plan_edit(old, new)
+        assert simulate(old, buffer) == new, (old, new)
+    assert plan_edit("Same.", "Same.") == b""
+    assert plan_edit("a" * 600, "b" * 600) is None
+    # A one character change at the end takes two keystrokes
+    assert keystrokes(plan_edit("Hello world.", "Hello world!")) == 2
+    print("MATCH")
+
+def test_session():
+    sent_buffers = []
+    original_write = edit_mode.write_reports
+    edit_mode.write_reports = lambda buffer: sent_buffers.append(buffer) or True
+    try:
+        session = EditSession()
+        assert session.type("Hello world.") is None
+
+        # Smart quotes are compared as they were typed
+        session.remember("Hello “world”.")
+        assert session.type('Hello "world"!') == (2, 14)
+        assert simulate('Hello "world".', sent_buffers[-1]) == 'Hello "world"!'
+
+        # Unrelated text, or edits spread through a long text, are typed in full
+        # by the caller rather than replacing the previous output
+        assert session.type("Something else entirely.") is None
+        spread = "The quick brown fox jumps over the lazy dog. " * 24
+        session.remember(spread)
+        assert session.type(spread.replace("fox", "cat")) is None
+        assert len(sent_buffers) == 1
+    finally:
+        edit_mode.write_reports = original_write
+    print("MATCH")
+
+def test_failed_write():
+    # The host is not reading reports: nothing reaches it, so nothing may be edited later
+    original_write = keyboard_mapper.write_report
+    keyboard_mapper.write_report = lambda report: False
+    try:
+        session = EditSession()
+        session.remember("Hello world.")
+        assert session.type("Hello world!") == (2, 12)
+        assert session.last_text is None
+        assert session.type("Hello world?") is None
+    finally:
+        keyboard_mapper.write_report = original_write
+    print("MATCH")
+
+PARAGRAPH = (
+    "Thanks for sending over the quarterly report. I had a chance to read through it this morning "
+    "and overall the numbers look strong, especially the growth in the northeast region. "
+    "A couple of things stood out that I think we should discuss before the board meeting. "
+    "First, the marketing spend in March seems unusually high compared to the previous two months, "
+    "and I could not find an explanation for it in the notes. Second, the projections for next quarter "
+    "assume the new product launch happens on schedule, which may be optimistic given the delays "
+    "we have seen with the supplier. Could we set up a call on Thursday afternoon to go over these "
+    "points? Let me know what time works for you."
+)
+
+def test_long_text_savings():
+    sent_buffers = []
+    original_write = edit_mode.write_reports
+    edit_mode.write_reports = lambda buffer: sent_buffers.append(buffer) or True
+    try:
+        # Re-dictating the closing with a different day and sign-off
+        revised = PARAGRAPH.replace(
+            "Could we set up a call on Thursday afternoon to go over these points? Let me know what time works for you.",
+            "Could we set up a call on Friday morning to go over these points? Let me know what time works best for you. Thanks!")
+        session = EditSession()
+        session.remember(PARAGRAPH)
+        sent, full = session.type(revised)
+        assert simulate(PARAGRAPH, sent_buffers[-1]) == revised
+        print(f"Saved {full - sent} of {full} keystrokes")
+        assert sent * 3 < full
+    finally:
+        edit_mode.write_reports = original_write
+    print("MATCH")
+
+if __name__ == "__main__":
+    test_diff()
+    test_plan()
+    test_session()
+    test_failed_write()
+    test_long_text_savings()
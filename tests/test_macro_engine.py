@@ -0,0 +1,75 @@
+import sys
+import os
+import json
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from macro_engine import MacroEngine
+from keyboard_mapper import compile_text, key_reports, parse_chord
+
+# Minimal stand-in for evdev.ecodes.ecodes
+KEY_CODES = {
+    'KEY_W': 17, 'KEY_E': 18, 'KEY_S': 31,
+    'KEY_LEFTCTRL': 29, 'KEY_RIGHTCTRL': 97,
+}
+
+def make_engine(config):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'macros.json')
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    return MacroEngine(path, key_codes=KEY_CODES), path
+
+def test_compile():
+    os.environ['TEST_MACRO_EMAIL'] = 'me@example.com'
+    engine, _ = make_engine({
+        'KEY_E': ['${TEST_MACRO_EMAIL}', {'key': 'enter'}],
+        'KEY_LEFTCTRL+KEY_S': [{'key': 'ctrl+shift+left'}],
+        'KEY_W': '${TEST_MACRO_MISSING}',
+    })
+
+    expected = compile_text('me@example.com') + key_reports(0, 0x28)
+    assert engine.key_event(18, 1) == expected
+    assert engine.key_event(18, 2) is None  # auto-repeat
+    engine.key_event(18, 0)
+
+    # Missing environment variables skip the macro
+    assert engine.key_event(17, 1) is None
+    engine.key_event(17, 0)
+
+    # Chords match either ctrl key, and not the bare key
+    assert engine.key_event(31, 1) is None
+    engine.key_event(31, 0)
+    engine.key_event(97, 1)
+    assert engine.key_event(31, 1) == key_reports(*parse_chord('ctrl+shift+left'))
+    engine.close()
+    print("MATCH")
+
+def test_reload():
+    engine, path = make_engine({'KEY_E': 'one'})
+    assert engine.key_event(18, 1) == compile_text('one')
+    engine.key_event(18, 0)
+
+    with open(path, 'w') as f:
+        json.dump({'KEY_E': 'two'}, f)
+    # Without inotify, bypass the poll rate limit and mtime granularity
+    if engine.watch is None:
+        engine.last_poll = 0.0
+        engine.last_mtime = None
+    engine.reload_if_changed()
+    assert engine.key_event(18, 1) == compile_text('two')
+    engine.key_event(18, 0)
+
+    # A broken config keeps the previous macros
+    with open(path, 'w') as f:
+        f.write('{')
+    engine.reload()
+    assert engine.key_event(18, 1) == compile_text('two')
+    engine.close()
+    print("MATCH")
+
+if __name__ == "__main__":
+    test_compile()
+    test_reload()
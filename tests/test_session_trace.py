@@ -0,0 +1,115 @@
+import sys
+import os
+import tempfile
+from collections import namedtuple
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import session_trace
+from session_trace import INPUT, PCM, RESPONSE, HID
+from trace_replay import ReplayResult, compare
+
+Event = namedtuple('Event', ['type', 'code', 'value'])
+
+def record_session(path):
+    session_trace.start(path)
+    session_trace.input_event(Event(1, 59, 1))
+    session_trace.pcm(b'\x01\x02' * 4)
+    session_trace.input_event(Event(1, 59, 0))
+    with session_trace.stage('transcribe'):
+        session_trace.response('transcription', 'hello')
+    session_trace.response('completion', 'Hello.')
+    with session_trace.stage('type'):
+        session_trace.hid(bytes([2, 0, 0x0B, 0, 0, 0, 0, 0]))
+        session_trace.hid(bytes(8))
+    session_trace.stop()
+
+def test_round_trip():
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    record_session(path)
+    records = session_trace.read_trace(path)
+
+    assert [r.type for r in records if r.type in (INPUT, PCM, RESPONSE, HID)] == [INPUT, PCM, INPUT, RESPONSE, RESPONSE, HID, HID]
+    assert session_trace.decode_input(records[0]) == (1, 59, 1)
+    assert session_trace.decode_response(records[4]) == ('transcription', 'hello')
+    assert session_trace.hid_reports(records)[0] == bytes([2, 0, 0x0B, 0, 0, 0, 0, 0])
+    assert set(session_trace.stage_durations(records)) == {'transcribe', 'type'}
+
+    # A truncated final record is dropped rather than failing the whole trace
+    with open(path, 'ab') as f:
+        f.write(session_trace.RECORD.pack(HID, 0, 8) + b'\x00\x00')
+    assert len(session_trace.read_trace(path)) == len(records)
+    print("MATCH")
+
+def test_private():
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    # An existing world-readable file is tightened too
+    open(path, 'w').close()
+    os.chmod(path, 0o644)
+
+    session_trace.start(path)
+    with session_trace.stage('macro'), session_trace.redacted():
+        session_trace.hid(bytes([0, 0, 0x13, 0, 0, 0, 0, 0]))
+    session_trace.hid(bytes(8))
+    session_trace.stop()
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    records = session_trace.read_trace(path)
+    assert session_trace.hid_reports(records) == [bytes(8)]
+    assert 'macro' in session_trace.stage_durations(records)
+    print("MATCH")
+
+def test_sessions():
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    record_session(path)
+    first = session_trace.read_trace(path)
+
+    # A killed run leaves a half written record; the next start appends after the last whole one
+    with open(path, 'ab') as f:
+        f.write(session_trace.RECORD.pack(HID, 0, 8) + b'\x00\x00')
+    session_trace.start(path, {'edit_mode': True})
+    session_trace.input_event(Event(1, 60, 1))
+    # Records reach the file as they are written, without waiting for stop()
+    assert [r.type for r in session_trace.read_trace(path)] == [INPUT]
+    session_trace.stop()
+
+    sessions = session_trace.read_sessions(path)
+    assert len(sessions) == 2
+    assert sessions[0].records == first
+    assert sessions[0].config == {} and sessions[1].config == {'edit_mode': True}
+    assert session_trace.read_trace(path, 0) == first
+    assert session_trace.decode_input(session_trace.read_trace(path)[0]) == (1, 60, 1)
+
+    # Anything that is not a trace is left alone
+    other = os.path.join(tempfile.mkdtemp(), 'notes.txt')
+    with open(other, 'w') as f:
+        f.write('notes')
+    try:
+        session_trace.start(other)
+        assert False, "started a trace on a file that is not one"
+    except ValueError:
+        pass
+    with open(other) as f:
+        assert f.read() == 'notes'
+    print("MATCH")
+
+def test_compare():
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    record_session(path)
+    baseline = session_trace.read_trace(path)
+    reports = session_trace.hid_reports(baseline)
+
+    assert compare(baseline, ReplayResult(baseline, reports, 0, 0))
+    assert not compare(baseline, ReplayResult(baseline, reports[:1], 0, 0))
+
+    # Stretch the 'type' stage well past the tolerance
+    slow = [r._replace(time=r.time + 1.0) if r.type == session_trace.END and r.payload == b'type' else r for r in baseline]
+    assert not compare(baseline, ReplayResult(slow, reports, 0, 0))
+    print("MATCH")
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_private()
+    test_sessions()
+    test_compare()
@@ -0,0 +1,122 @@
+import sys
+import os
+import json
+import types
+import tempfile
+from collections import namedtuple
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# pyaudio needs PortAudio to build; replay never opens a real stream
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = types.ModuleType('pyaudio')
+    pyaudio.paInt16 = 8
+    sys.modules['pyaudio'] = pyaudio
+
+import session_trace
+from keyboard_mapper import compile_typing
+from edit_mode import plan_edit
+from trace_replay import replay, compare
+
+Event = namedtuple('Event', ['type', 'code', 'value'])
+
+EV_KEY = 1
+KEY_F1 = 59
+RESPONSE = "Hello, World."
+
+def record_dictation(transcription, completion, typed, error=None):
+    """Records what main.py would for a short F1 dictation."""
+    session_trace.input_event(Event(EV_KEY, KEY_F1, 1))
+    session_trace.begin('record')
+    for i in range(4):
+        session_trace.pcm(bytes([i]) * 2048)
+    session_trace.input_event(Event(EV_KEY, KEY_F1, 0))
+    session_trace.end('record')
+    session_trace.begin('respond')
+    with session_trace.stage('transcribe'):
+        pass
+    if error:
+        session_trace.error('transcription', error)
+    else:
+        session_trace.response('transcription', transcription)
+        with session_trace.stage('complete'):
+            pass
+        session_trace.response('completion', completion)
+    with session_trace.stage('type'):
+        for offset in range(0, len(typed), 8):
+            session_trace.hid(typed[offset:offset + 8])
+    session_trace.end('respond')
+
+def record_session(path):
+    session_trace.start(path)
+    record_dictation('hello world', RESPONSE, compile_typing(RESPONSE)[0])
+    session_trace.stop()
+
+def run_replay(path, realtime=False):
+    directory = os.path.dirname(path)
+
+    # No macros, so the replay only depends on the trace
+    macro_config = os.path.join(directory, 'macros.json')
+    with open(macro_config, 'w') as f:
+        json.dump({}, f)
+    previous = os.environ.get('MACRO_CONFIG')
+    os.environ['MACRO_CONFIG'] = macro_config
+    try:
+        result = replay(path, realtime=realtime, save_path=os.path.join(directory, 'replay.trace'))
+    finally:
+        if previous is None:
+            os.environ.pop('MACRO_CONFIG', None)
+        else:
+            os.environ['MACRO_CONFIG'] = previous
+
+    baseline = session_trace.read_trace(path)
+    assert result.reports == session_trace.hid_reports(baseline)
+    assert result.padded == 0 and result.skipped == 0
+    return baseline, result
+
+def replay_dictation(realtime):
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    record_session(path)
+    baseline, result = run_replay(path, realtime)
+    assert {'record', 'respond', 'transcribe', 'complete', 'type'} <= set(session_trace.stage_durations(result.records))
+    # Timings are not checked here; the synthetic baseline has no typing delays
+    compare(baseline, result)
+    print("MATCH")
+
+def test_replay_fast():
+    replay_dictation(realtime=False)
+
+def test_replay_realtime():
+    replay_dictation(realtime=True)
+
+def test_replay_error():
+    # A failed call fails again in the replay instead of taking the next session's response
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    session_trace.start(path)
+    record_dictation(None, None, compile_typing("Error: LLM Request Timed Out")[0], error="LLM Request Timed Out")
+    record_dictation('hello world', RESPONSE, compile_typing(RESPONSE)[0])
+    session_trace.stop()
+
+    _, result = run_replay(path)
+    assert [r for r in result.records if r.type == session_trace.ERROR]
+    print("MATCH")
+
+def test_replay_edit_mode():
+    # Edit mode is replayed as recorded, whatever EDIT_MODE is where the replay runs
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    session_trace.start(path, {"edit_mode": True})
+    record_dictation('hello world', "Hello world.", compile_typing("Hello world.")[0])
+    record_dictation('hello world', "Hello world!", plan_edit("Hello world.", "Hello world!"))
+    session_trace.stop()
+
+    run_replay(path)
+    print("MATCH")
+
+if __name__ == "__main__":
+    test_replay_fast()
+    test_replay_realtime()
+    test_replay_error()
+    test_replay_edit_mode()
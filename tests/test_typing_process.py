@@ -0,0 +1,148 @@
+import sys
+import os
+import tty
+import time
+import tempfile
+import threading
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import keyboard_mapper
+import session_trace
+from keyboard_mapper import compile_typing, compile_text, run_schedule, timing_stats, RELEASE_REPORT
+from typing_process import TypingProcess
+
+class FakeHid:
+    """A raw pty standing in for /dev/hidg0."""
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.received = []
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        while True:
+            try:
+                self.received.append(os.read(self.master, 4096))
+            except OSError:
+                break
+
+    def data(self):
+        time.sleep(0.1)
+        return b"".join(self.received)
+
+    def close(self):
+        # The reader gets EIO once the slave is closed; wait for it so a
+        # later pty cannot reuse the master fd under it
+        os.close(self.slave)
+        self.thread.join(1)
+        os.close(self.master)
+
+def test_schedule():
+    written = []
+    buffer, gaps = compile_typing("Hi.")
+    timings = run_schedule(buffer, gaps, write=written.append)
+
+    assert b"".join(written) == buffer
+    # Deadlines are absolute: each one is the start plus the sum of the gaps before it
+    start = timings[0][0]
+    for i, (deadline, actual) in enumerate(timings):
+        assert abs(deadline - (start + sum(gaps[:i]))) < 1e-9
+        assert actual >= deadline
+
+    stats = timing_stats(timings)
+    assert stats["reports"] == len(buffer) // 8
+    assert stats["late_p50"] <= stats["late_max"]
+    print("MATCH")
+
+def test_release_on_failure():
+    written = []
+    def write(report):
+        # The host stops reading after the third report (a press)
+        if len(written) == 2:
+            written.append(None)
+            return False
+        written.append(report)
+    buffer = compile_text("ab")
+    timings = run_schedule(buffer, [0.0] * 4, write=write)
+    assert len(timings) == 2
+    assert written[-1] == RELEASE_REPORT
+    print("MATCH")
+
+def test_in_process():
+    # Without a typing process the device is opened once for the whole buffer
+    hid = FakeHid()
+    original_dev, original_open = keyboard_mapper.HID_DEV, os.open
+    opens = []
+    def counting_open(path, *args):
+        if path == hid.path:
+            opens.append(path)
+        return original_open(path, *args)
+    keyboard_mapper.HID_DEV = hid.path
+    os.open = counting_open
+    try:
+        buffer, gaps = compile_typing("Hello, World!")
+        assert keyboard_mapper.play_reports(buffer, [0.0] * len(gaps))
+        assert len(opens) == 1
+    finally:
+        os.open = original_open
+        keyboard_mapper.HID_DEV = original_dev
+        hid.close()
+    print("MATCH")
+
+def test_process():
+    hid = FakeHid()
+    trace_path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    typist = TypingProcess(hid.path)
+    typist.start()
+    keyboard_mapper.typist = typist
+    try:
+        buffer, _ = compile_typing("Hello, World!")
+        session_trace.start(trace_path)
+        with session_trace.stage('type'):
+            assert keyboard_mapper.type_string("Hello, World!")
+        session_trace.stop()
+        assert hid.data() == buffer
+
+        # Traced reports carry the times the child wrote them, spread over the typing stage
+        records = session_trace.read_trace(trace_path)
+        hid_times = [r.time for r in records if r.type == session_trace.HID]
+        assert b"".join(session_trace.hid_reports(records)) == buffer
+        assert hid_times == sorted(hid_times)
+        assert hid_times[-1] - hid_times[0] > 0.2
+    finally:
+        session_trace.stop()
+        keyboard_mapper.typist = None
+        typist.close()
+        hid.close()
+    print("MATCH")
+
+def test_child_dies_mid_job():
+    hid = FakeHid()
+    typist = TypingProcess(hid.path)
+    typist.start()
+    keyboard_mapper.typist = typist
+    try:
+        buffer, gaps = compile_typing("abcdefghijklmnopqrstuvwxyz")
+        threading.Timer(0.3, typist.proc.kill).start()
+        assert not keyboard_mapper.play_reports(buffer, gaps)
+
+        # Only what the child typed reached the host, followed by a release
+        data = hid.data()
+        assert len(data) < len(buffer)
+        assert buffer.startswith(data[:-8]) and data.endswith(RELEASE_REPORT)
+    finally:
+        keyboard_mapper.typist = None
+        typist.close()
+        hid.close()
+    print("MATCH")
+
+if __name__ == "__main__":
+    test_schedule()
+    test_release_on_failure()
+    test_in_process()
+    test_process()
+    test_child_dies_mid_job()